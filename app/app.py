@@ -1,19 +1,23 @@
 from flask import Flask, render_template, request, jsonify, Response
 import os
 import math
-from moviepy.editor import ImageClip, VideoFileClip
 import numpy as np
 import logging
-from skimage.transform import resize
 import json
 from .config import Config
+from .resample import resample_crop
+from .overlay_store import build_store, load_store, store_path
 import time
 from concurrent.futures import ThreadPoolExecutor
 import subprocess
 from contextlib import contextmanager
-from threading import Timer, Event, Lock
+from threading import Thread, Timer, Event, Lock
 from flask_cors import CORS
 
+# Тяжелые модули рендера (moviepy, skimage) загружаются лениво,
+# чтобы импорт модуля и запуск Flask не ждали их
+ImageClip = VideoFileClip = get_setting = resize = None
+
 logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -21,6 +25,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def load_render_modules():
+    global ImageClip, VideoFileClip, get_setting, resize
+    if resize is None:
+        from moviepy.editor import ImageClip, VideoFileClip
+        from moviepy.config import get_setting
+        from skimage.transform import resize
+
+
 def check_ffmpeg_version():
     try:
         result = subprocess.run(['ffmpeg', '-version'], 
@@ -32,8 +44,27 @@ def check_ffmpeg_version():
 
 
 
+class BoundedOverlayCache(dict):
+    """Кэш кадров наложений одной задачи с лимитом памяти (для размеров больше основного).
+
+    Кадры запрашиваются по кругу в одном и том же порядке, поэтому вытеснение
+    (LRU) не дало бы попаданий: после заполнения новые кадры просто не добавляются.
+    """
+    def __init__(self, max_bytes=Config.OVERLAY_CACHE_MAX_BYTES):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+
+    def __setitem__(self, key, frames):
+        frames_bytes = sum(frame.nbytes for frame in frames)
+        if key in self or self.nbytes + frames_bytes > self.max_bytes:
+            return
+        super().__setitem__(key, frames)
+        self.nbytes += frames_bytes
+
+
 class VideoGeneratorApp:
-    def __init__(self):
+    def __init__(self, warm_up=True):
         self.app = Flask(__name__,
                         static_folder=Config.STATIC_FOLDER,
                         template_folder=Config.TEMPLATE_FOLDER)
@@ -47,19 +78,69 @@ class VideoGeneratorApp:
         os.makedirs(Config.STATIC_FOLDER, exist_ok=True)
         os.makedirs(Config.TEMPLATE_FOLDER, exist_ok=True)
 
-        check_ffmpeg_version()
-        
         self.overlay_paths = {
             'soft_light': os.path.join(os.path.dirname(self.UPLOAD_FOLDER), 'SIDE_ADDONS_shurehi_soft_light.mov'),
             'screen': os.path.join(os.path.dirname(self.UPLOAD_FOLDER), 'SIDE_ADDONS_shurehi_screen.mov')
         }
         
-        self._check_overlay_files()
-        
         self.user_tasks = {}
+        self.blend_tables = None
+        self.blend_tables_lock = Lock()
+        # Кадры наложений основного размера, общие для всех задач (заполняются прогревом)
+        self.overlay_cache = {}
+        # Хранилища готовых кадров наложений по размеру композитинга
+        self.overlay_stores = {}
+        self.readiness = {'status': 'starting', 'started_at': time.time()}
+        if Config.VIDEO_PROFILE and Config.VIDEO_PROFILE not in Config.VIDEO_PROFILES:
+            logger.warning(f"Unknown VIDEO_PROFILE '{Config.VIDEO_PROFILE}', expected one of "
+                           f"{', '.join(Config.VIDEO_PROFILES)}; profile will be selected by load")
         self.executor = ThreadPoolExecutor(max_workers=10)
+        # Задания пула, которые сейчас рендерятся (видео или целый альбом)
+        self.running_jobs = 0
+        self.running_jobs_lock = Lock()
         self.setup_routes()
 
+        if warm_up:
+            Thread(target=self.warm_up, daemon=True).start()
+
+    def warm_up(self):
+        """Фоновый прогрев: проверки окружения, загрузка модулей рендера,
+        таблицы смешивания, кадры наложений и один тестовый кадр"""
+        try:
+            check_ffmpeg_version()
+            self._check_overlay_files()
+            load_render_modules()
+            self.get_blend_tables()
+
+            self.load_overlay_store(build=Config.OVERLAY_STORE_AUTO_BUILD)
+            # Хранилища дополнительных форматов большие, их собирают заранее:
+            # python -m app.overlay_store build --targets ...
+            for size in self.get_store_sizes(Config.OUTPUT_TARGETS)[1:]:
+                if os.path.exists(f"{store_path(size)}.json"):
+                    self.load_overlay_store(size)
+
+            with self.create_overlay_clips() as overlays:
+                if Config.PRELOAD_OVERLAY_FRAMES and self.get_overlay_store() is None:
+                    for t in np.arange(0, Config.VIDEO_DURATION, 1.0 / Config.VIDEO_FPS):
+                        self.get_overlay_frames(t, overlays, self.overlay_cache)
+
+                test_image = np.full((64, 48, 3), 128, dtype=np.uint8)
+                test_frame = {'x': 0, 'y': 0, 'width': 48, 'height': 64}
+                with self.create_clips(test_image, overlays) as clips:
+                    self.make_frame(0, clips, test_frame, test_frame, -10, self.get_overlay_cache())
+
+            self.readiness.update({'status': 'ready', 'ready_at': time.time()})
+            logger.info(f"Warm-up finished in {self.readiness['ready_at'] - self.readiness['started_at']:.2f}s")
+        except Exception as e:
+            logger.error(f"Warm-up failed: {e}")
+            self.readiness.update({'status': 'error', 'error': str(e)})
+
+    def health(self):
+        readiness = dict(self.readiness)
+        if 'ready_at' in readiness:
+            readiness['warmup_time'] = round(readiness['ready_at'] - readiness['started_at'], 3)
+        return jsonify(readiness), 200 if readiness['status'] == 'ready' else 503
+
     @contextmanager
     def timeout_threading(self, seconds):
         timeout_event = Event()
@@ -72,21 +153,49 @@ class VideoGeneratorApp:
             timer.cancel()
 
     @contextmanager
-    def create_clips(self, image_path):
+    def create_overlay_clips(self, size=None, decode=False):
+        """Клипы наложений.
+
+        Если кадры размера size есть в хранилище overlay_store, декодер не открывается.
+        """
+        load_render_modules()
         clips = {}
         try:
-            clips['soft_light'] = VideoFileClip(self.overlay_paths['soft_light'])
-            clips['screen'] = VideoFileClip(self.overlay_paths['screen'])
-            clips['base'] = ImageClip(image_path)
+            if decode or self.get_overlay_store(size) is None:
+                clips['soft_light'] = VideoFileClip(self.overlay_paths['soft_light'])
+                clips['screen'] = VideoFileClip(self.overlay_paths['screen'])
             yield clips
         finally:
-            for name, clip in clips.items():
-                try:
-                    if clip is not None:
-                        clip.close()
-                        logger.debug(f"Closed clip: {name}")
-                except Exception as e:
-                    logger.error(f"Error closing clip {name}: {e}")
+            self._close_clips(clips)
+
+    @contextmanager
+    def create_clips(self, image_path, overlays=None, size=None):
+        """Клипы для рендера одного изображения.
+
+        overlays - уже открытые клипы наложений (пакетная обработка),
+        они переиспользуются и здесь не закрываются.
+        """
+        if overlays is None:
+            with self.create_overlay_clips(size) as overlays:
+                with self.create_clips(image_path, overlays) as clips:
+                    yield clips
+            return
+
+        clips = {}
+        try:
+            clips['base'] = ImageClip(image_path)
+            yield {**overlays, **clips}
+        finally:
+            self._close_clips(clips)
+
+    def _close_clips(self, clips):
+        for name, clip in clips.items():
+            try:
+                if clip is not None:
+                    clip.close()
+                    logger.debug(f"Closed clip: {name}")
+            except Exception as e:
+                logger.error(f"Error closing clip {name}: {e}")
 
     def _check_overlay_files(self):
         for path in self.overlay_paths.values():
@@ -115,8 +224,11 @@ class VideoGeneratorApp:
     
 
     def setup_routes(self):
+        self.app.add_url_rule('/health', 'health', self.health, methods=['GET'])
         self.app.add_url_rule('/cropper/<chat_id>/<task_id>', 'cropper', self.cropper)
+        self.app.add_url_rule('/batch_cropper/<chat_id>/<batch_id>', 'batch_cropper', self.batch_cropper)
         self.app.add_url_rule('/generate_video', 'generate_video', self.generate_video, methods=['POST'])
+        self.app.add_url_rule('/generate_batch', 'generate_batch', self.generate_batch, methods=['POST'])
         self.app.add_url_rule('/video_progress/<chat_id>', 'video_progress', self.video_progress, methods=['GET'])
         self.app.add_url_rule('/user_tasks/<chat_id>', 'get_user_tasks', self.get_user_tasks, methods=['GET'])
 
@@ -165,8 +277,50 @@ class VideoGeneratorApp:
         result = result * 1.3
         return np.clip(result * 255, 0, 255).astype(np.uint8)
 
-    def make_frame(self, t, clips, start_frame, end_frame, saturation_value):
+    def get_blend_tables(self):
+        """Таблицы смешивания 256x256: результат зависит только от пары значений uint8"""
+        with self.blend_tables_lock:
+            if self.blend_tables is None:
+                base, overlay = np.meshgrid(np.arange(256, dtype=np.uint8),
+                                            np.arange(256, dtype=np.uint8), indexing='ij')
+                self.blend_tables = {
+                    'soft_light': self.soft_light_blend(base, overlay),
+                    'screen': self.screen_blend(base, overlay)
+                }
+            return self.blend_tables
+
+    def get_overlay_frames(self, t, clips, overlay_cache=None, size=None):
+        """Кадры наложений для момента t, приведенные к размеру видео.
+
+        overlay_cache позволяет переиспользовать их между изображениями пакета.
+        """
+        overlay_store = self.get_overlay_store(size)
+        if overlay_store is not None:
+            frames = overlay_store.get(t)
+            if frames is not None:
+                return frames
+
+        width, height = size or (Config.VIDEO_WIDTH, Config.VIDEO_HEIGHT)
+        cache_key = (t, width, height)
+        if overlay_cache is not None and cache_key in overlay_cache:
+            return overlay_cache[cache_key]
+
+        overlay_frame_1 = clips['soft_light'].get_frame(t % clips['soft_light'].duration)
+        overlay_resized_1 = resize(overlay_frame_1, (height, width, 4),
+                                 preserve_range=True)
+
+        overlay_frame_2 = clips['screen'].get_frame(t % clips['screen'].duration)
+        overlay_resized_2 = resize(overlay_frame_2, (height, width, 4),
+                                 preserve_range=True)
+
+        frames = (overlay_resized_1.astype(np.uint8), overlay_resized_2.astype(np.uint8))
+        if overlay_cache is not None:
+            overlay_cache[cache_key] = frames
+        return frames
+
+    def make_frame(self, t, clips, start_frame, end_frame, saturation_value, overlay_cache=None, size=None):
         try:
+            width, height = size or (Config.VIDEO_WIDTH, Config.VIDEO_HEIGHT)
             half_duration = Config.VIDEO_DURATION / 2
             if t <= half_duration:
                 factor = t / half_duration
@@ -180,26 +334,15 @@ class VideoGeneratorApp:
             w = start_frame['width'] + (end_frame['width'] - start_frame['width']) * factor
             h = start_frame['height'] + (end_frame['height'] - start_frame['height']) * factor
     
+            # Кроп с дробными координатами: без рывков на медленных панорамах
             base_frame = clips['base'].get_frame(0)
-            cropped = base_frame[int(y):int(y+h), int(x):int(x+w)]
-    
-            base_resized = resize(cropped, (Config.VIDEO_HEIGHT, Config.VIDEO_WIDTH, 3),
-                                preserve_range=True, anti_aliasing=True, mode='reflect')
+            base_resized = resample_crop(base_frame, x, y, w, h, width, height)
     
             # Применяем настройку насыщенности
             base_resized = self.adjust_saturation(base_resized.astype(np.uint8), saturation_value)
     
-            overlay_frame_1 = clips['soft_light'].get_frame(t % clips['soft_light'].duration)
-            overlay_resized_1 = resize(overlay_frame_1, (Config.VIDEO_HEIGHT, Config.VIDEO_WIDTH, 4),
-                                     preserve_range=True)
-    
-            overlay_frame_2 = clips['screen'].get_frame(t % clips['screen'].duration)
-            overlay_resized_2 = resize(overlay_frame_2, (Config.VIDEO_HEIGHT, Config.VIDEO_WIDTH, 4),
-                                     preserve_range=True)
-    
-            base_resized = base_resized.astype(np.uint8)
-            overlay_resized_1 = overlay_resized_1.astype(np.uint8)
-            overlay_resized_2 = overlay_resized_2.astype(np.uint8)
+            overlay_resized_1, overlay_resized_2 = self.get_overlay_frames(t, clips, overlay_cache, size)
+            blend_tables = self.get_blend_tables()
     
             overlay_rgb_1 = overlay_resized_1[..., :3]
             overlay_alpha_1 = overlay_resized_1[..., 3:] / 255.0
@@ -209,10 +352,11 @@ class VideoGeneratorApp:
             overlay_alpha_2 = overlay_resized_2[..., 3:] / 255.0
             overlay_alpha_2 = np.clip(overlay_alpha_2 * 1.5, 0, 1)
     
-            blended_1 = self.soft_light_blend(base_resized, overlay_rgb_1)
+            blended_1 = blend_tables['soft_light'][base_resized, overlay_rgb_1]
             intermediate_1 = base_resized * (1 - overlay_alpha_1) + blended_1 * overlay_alpha_1
             
-            blended_2 = self.screen_blend(intermediate_1.astype(np.uint8), overlay_rgb_2)
+            intermediate_1_uint8 = intermediate_1.astype(np.uint8)
+            blended_2 = blend_tables['screen'][intermediate_1_uint8, overlay_rgb_2]
             final = intermediate_1 * (1 - overlay_alpha_2) + blended_2 * overlay_alpha_2
     
             return final.astype(np.uint8)
@@ -220,45 +364,334 @@ class VideoGeneratorApp:
             logger.error(f"Error in make_frame: {e}")
             raise
 
-    def process_video(self, chat_id, task_id, image_path, start_frame, end_frame, saturation_value):
+    def parse_output_targets(self, targets):
+        """Список форматов вывода; основной формат нужен боту всегда и идет первым"""
+        result = [Config.DEFAULT_OUTPUT_TARGET]
+        for target in targets or []:
+            if target not in Config.OUTPUT_TARGETS:
+                raise ValueError(f"Unknown output target: {target}")
+            if target not in result:
+                result.append(target)
+        return result
+
+    def get_render_size(self, targets):
+        """Размер кадра композитинга, из которого можно вырезать все форматы без апскейла"""
+        aspect = Config.VIDEO_WIDTH / Config.VIDEO_HEIGHT
+        height = Config.VIDEO_HEIGHT
+        for target in targets:
+            spec = Config.OUTPUT_TARGETS[target]
+            if spec['width'] / spec['height'] <= aspect:
+                height = max(height, spec['height'])
+            else:
+                height = max(height, spec['width'] / aspect)
+        height = int(math.ceil(height / 2) * 2)
+        width = int(round(height * aspect / 2) * 2)
+        return width, height
+
+    def get_target_filter(self, target, width, height):
+        spec = Config.OUTPUT_TARGETS[target]
+        aspect = spec['width'] / spec['height']
+        if aspect < width / height:
+            crop_width, crop_height = int(round(height * aspect / 2) * 2), height
+        else:
+            crop_width, crop_height = width, int(round(width / aspect / 2) * 2)
+
+        chain = f"crop={crop_width}:{crop_height},scale={spec['width']}:{spec['height']}:flags=lanczos"
+        if 'fps' in spec:
+            chain += f",fps={spec['fps']}"
+        return chain
+
+    def get_output_path(self, chat_id, task_id, target=Config.DEFAULT_OUTPUT_TARGET, temp=False):
+        name = 'temp' if temp else 'video'
+        if target != Config.DEFAULT_OUTPUT_TARGET:
+            name += f"_{target}"
+        return os.path.join(self.UPLOAD_FOLDER, f"{chat_id}_{task_id}_{name}.mp4")
+
+    def get_store_sizes(self, targets):
+        """Размеры композитинга: основной и для каждого дополнительного формата"""
+        sizes = [(Config.VIDEO_WIDTH, Config.VIDEO_HEIGHT)]
+        for target in targets:
+            size = self.get_render_size([Config.DEFAULT_OUTPUT_TARGET, target])
+            if size not in sizes:
+                sizes.append(size)
+        return sizes
+
+    def get_overlay_store(self, size=None):
+        return self.overlay_stores.get(tuple(size or (Config.VIDEO_WIDTH, Config.VIDEO_HEIGHT)))
+
+    def load_overlay_store(self, size=None, build=False):
+        """Подключение хранилища кадров размера size; build - собрать, если нет или устарело"""
+        size = tuple(size or (Config.VIDEO_WIDTH, Config.VIDEO_HEIGHT))
+        overlay_store = load_store(self.overlay_paths, size)
+        if overlay_store is None and build:
+            build_store(self, size)
+            overlay_store = load_store(self.overlay_paths, size)
+        if overlay_store is not None:
+            self.overlay_stores[size] = overlay_store
+        return overlay_store
+
+    def get_overlay_cache(self, targets=None):
+        """Общий кэш кадров наложений, если рендер идет в основном размере"""
+        if not Config.PRELOAD_OVERLAY_FRAMES or self.get_overlay_store() is not None:
+            return None
+        if self.get_render_size(targets or [Config.DEFAULT_OUTPUT_TARGET]) != (Config.VIDEO_WIDTH, Config.VIDEO_HEIGHT):
+            return None
+        return self.overlay_cache
+
+    def create_job_overlay_cache(self, size):
+        """Кэш кадров наложений для нескольких видео подряд (альбом, воркер app.render).
+
+        Если есть хранилище этого размера, кэш не нужен. В основном размере кэшируются
+        все кадры, в увеличенном - сколько помещается в OVERLAY_CACHE_MAX_BYTES.
+        """
+        if self.get_overlay_store(size) is not None:
+            return None
+        if tuple(size) == (Config.VIDEO_WIDTH, Config.VIDEO_HEIGHT):
+            return {}
+        return BoundedOverlayCache()
+
+    @contextmanager
+    def track_running_job(self):
+        with self.running_jobs_lock:
+            self.running_jobs += 1
         try:
-            with self.create_clips(image_path) as clips:
-                def frame_generator(t):
-                    progress = int((t / Config.VIDEO_DURATION) * 100)
-                    self.update_task_status(chat_id, task_id, 'processing', progress)
-                    return self.make_frame(t, clips, start_frame, end_frame, saturation_value)
-    
-                temp_video_path = os.path.join(self.UPLOAD_FOLDER, f"{chat_id}_{task_id}_temp.mp4")
-                final_video_path = os.path.join(self.UPLOAD_FOLDER, f"{chat_id}_{task_id}_video.mp4")
-    
-                try:
-                    video = VideoFileClip(image_path, audio=False).set_duration(Config.VIDEO_DURATION)
-                    video = video.fl(lambda gf, t: frame_generator(t))
-                    
-                    video.write_videofile(
-                        temp_video_path,
-                        fps=Config.VIDEO_FPS,
-                        codec=Config.VIDEO_CODEC,
-                        audio=False,
-                        preset=Config.VIDEO_PRESET,
-                        threads=Config.VIDEO_THREADS
-                    )
-                finally:
-                    if 'video' in locals():
-                        video.close()
-    
-                if os.path.exists(temp_video_path) and os.path.getsize(temp_video_path) > 0:
-                    os.rename(temp_video_path, final_video_path)
-                    self.create_completion_flag(chat_id, task_id)
-                    self.update_task_status(chat_id, task_id, 'completed', 100)
-                else:
-                    raise RuntimeError("Failed to create video file")
+            yield
+        finally:
+            with self.running_jobs_lock:
+                self.running_jobs -= 1
+
+    def select_encoding_profile(self):
+        """Выбор профиля кодирования по текущей загрузке очереди.
+
+        Загрузка - занятые слоты пула (включая вызывающее задание) плюс задания
+        в очереди. Альбом занимает один слот, поэтому считается одним заданием.
+        """
+        if Config.VIDEO_PROFILE in Config.VIDEO_PROFILES:
+            return Config.VIDEO_PROFILE
+
+        with self.running_jobs_lock:
+            load = self.running_jobs + self.executor._work_queue.qsize()
+
+        if load >= Config.VIDEO_PROFILE_BUSY_LOAD:
+            return 'fast'
+        if load <= Config.VIDEO_PROFILE_IDLE_LOAD:
+            return 'small'
+        return 'balanced'
+
+    def build_ffmpeg_params(self, profile):
+        params = ['-crf', str(profile['crf']), '-movflags', '+faststart']
+        if profile.get('maxrate'):
+            params += ['-maxrate', profile['maxrate'], '-bufsize', profile['bufsize']]
+        return params
+
+    def record_encode_stats(self, chat_id, task_id, profile_name, target_bytes, render_time, composite_time):
+        """Статистика кодирования.
+
+        render_time - весь рендер; composite_time - время make_frame, encode_time - остальное
+        (кодирование и ожидание ffmpeg). target_bytes - размеры файлов по форматам.
+        """
+        total_output_bytes = sum(target_bytes.values())
+        stats = {
+            'profile': profile_name,
+            'target_bytes': target_bytes,
+            'total_output_bytes': total_output_bytes,
+            'render_time': round(render_time, 3),
+            'composite_time': round(composite_time, 3),
+            'encode_time': round(render_time - composite_time, 3)
+        }
+        with self.user_tasks_lock:
+            if chat_id in self.user_tasks and task_id in self.user_tasks[chat_id]:
+                self.user_tasks[chat_id][task_id].update(stats)
+
+        logger.info(f"Encoded task {task_id} with profile '{profile_name}': "
+                    f"{total_output_bytes / 1024 / 1024:.2f} MB in {render_time:.2f}s "
+                    f"(compositing {composite_time:.2f}s, encoding {render_time - composite_time:.2f}s)")
+        try:
+            with open(Config.ENCODE_STATS_FILE, 'a') as f:
+                f.write(json.dumps({'task_id': task_id, 'timestamp': time.time(), **stats}) + '\n')
+        except Exception as e:
+            logger.error(f"Error writing encode stats: {e}")
+
+    def write_video(self, output_path, image_path, clips, start_frame, end_frame, saturation_value,
+                    profile_name, overlay_cache=None, progress_callback=None,
+                    threads=Config.VIDEO_THREADS, moviepy_logger='bar'):
+        """Рендер и кодирование одного видео в output_path.
+
+        Возвращает время композитинга (make_frame) в секундах.
+        """
+        profile = Config.VIDEO_PROFILES[profile_name]
+        composite_time = 0.0
+
+        def frame_generator(t):
+            nonlocal composite_time
+            if progress_callback:
+                progress_callback(int((t / Config.VIDEO_DURATION) * 100))
+            frame_start = time.perf_counter()
+            frame = self.make_frame(t, clips, start_frame, end_frame, saturation_value, overlay_cache)
+            composite_time += time.perf_counter() - frame_start
+            return frame
+
+        try:
+            video = VideoFileClip(image_path, audio=False).set_duration(Config.VIDEO_DURATION)
+            video = video.fl(lambda gf, t: frame_generator(t))
+            
+            video.write_videofile(
+                output_path,
+                fps=Config.VIDEO_FPS,
+                codec=Config.VIDEO_CODEC,
+                audio=False,
+                preset=profile['preset'],
+                threads=threads,
+                ffmpeg_params=self.build_ffmpeg_params(profile),
+                logger=moviepy_logger
+            )
+        finally:
+            if 'video' in locals():
+                video.close()
+        return composite_time
+
+    def write_target_videos(self, output_paths, clips, start_frame, end_frame, saturation_value,
+                            profile_name, overlay_cache=None, progress_callback=None,
+                            threads=Config.VIDEO_THREADS):
+        """Один проход композитинга для нескольких форматов.
+
+        Кадры рендерятся один раз в размере get_render_size и передаются
+        в один процесс ffmpeg, который раздает их через split/crop/scale.
+        Возвращает время композитинга (make_frame) в секундах.
+        """
+        profile = Config.VIDEO_PROFILES[profile_name]
+        targets = list(output_paths)
+        width, height = self.get_render_size(targets)
+
+        filters = [f"[0:v]split={len(targets)}" + ''.join(f"[v{i}]" for i in range(len(targets)))]
+        outputs = []
+        for i, target in enumerate(targets):
+            filters.append(f"[v{i}]{self.get_target_filter(target, width, height)}[o{i}]")
+            outputs += [
+                '-map', f'[o{i}]',
+                '-c:v', Config.VIDEO_CODEC,
+                '-preset', profile['preset'],
+                *self.build_ffmpeg_params(profile),
+                '-pix_fmt', 'yuv420p',
+                '-threads', str(threads),
+                output_paths[target]
+            ]
+
+        cmd = [
+            get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-vcodec', 'rawvideo',
+            '-s', f'{width}x{height}', '-pix_fmt', 'rgb24',
+            '-r', str(Config.VIDEO_FPS), '-an', '-i', '-',
+            '-filter_complex', ';'.join(filters),
+            *outputs
+        ]
+
+        composite_time = 0.0
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for t in np.arange(0, Config.VIDEO_DURATION, 1.0 / Config.VIDEO_FPS):
+                if progress_callback:
+                    progress_callback(int((t / Config.VIDEO_DURATION) * 100))
+                frame_start = time.perf_counter()
+                frame = self.make_frame(t, clips, start_frame, end_frame, saturation_value,
+                                        overlay_cache, size=(width, height))
+                composite_time += time.perf_counter() - frame_start
+                process.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            # ffmpeg завершился раньше времени, причина будет в stderr
+            pass
+        finally:
+            _, stderr = process.communicate()
+
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+        return composite_time
+
+    def render_video(self, chat_id, task_id, image_path, clips, start_frame, end_frame,
+                     saturation_value, profile_name, overlay_cache=None, targets=None):
+        targets = targets or [Config.DEFAULT_OUTPUT_TARGET]
+        temp_paths = {target: self.get_output_path(chat_id, task_id, target, temp=True) for target in targets}
+
+        def progress_callback(progress):
+            self.update_task_status(chat_id, task_id, 'processing', progress)
+
+        render_start = time.time()
+        if targets == [Config.DEFAULT_OUTPUT_TARGET]:
+            composite_time = self.write_video(
+                temp_paths[Config.DEFAULT_OUTPUT_TARGET], image_path, clips, start_frame, end_frame,
+                saturation_value, profile_name, overlay_cache, progress_callback=progress_callback
+            )
+        else:
+            composite_time = self.write_target_videos(
+                temp_paths, clips, start_frame, end_frame, saturation_value,
+                profile_name, overlay_cache, progress_callback=progress_callback
+            )
+
+        if all(os.path.exists(path) and os.path.getsize(path) > 0 for path in temp_paths.values()):
+            self.record_encode_stats(chat_id, task_id, profile_name,
+                                     {target: os.path.getsize(path) for target, path in temp_paths.items()},
+                                     time.time() - render_start, composite_time)
+            for target, temp_path in temp_paths.items():
+                os.rename(temp_path, self.get_output_path(chat_id, task_id, target))
+            self.create_completion_flag(chat_id, task_id)
+            self.update_task_status(chat_id, task_id, 'completed', 100)
+        else:
+            raise RuntimeError("Failed to create video file")
+
+    def process_video(self, chat_id, task_id, image_path, start_frame, end_frame, saturation_value,
+                      targets=None):
+        try:
+            with self.track_running_job():
+                profile_name = self.select_encoding_profile()
+
+                size = self.get_render_size(targets or [Config.DEFAULT_OUTPUT_TARGET])
+                with self.create_clips(image_path, size=size) as clips:
+                    self.render_video(chat_id, task_id, image_path, clips, start_frame, end_frame,
+                                      saturation_value, profile_name, self.get_overlay_cache(targets),
+                                      targets)
     
         except Exception as e:
             logger.error(f"Error in process_video for task {task_id}: {e}")
             self.update_task_status(chat_id, task_id, 'error', 0)
             raise
 
+    def process_batch(self, chat_id, batch_id, jobs, targets=None):
+        """Рендер альбома в одной сессии.
+
+        Клипы наложений открываются один раз, их кадры и таблицы смешивания
+        переиспользуются для всех изображений пакета.
+        """
+        try:
+            with self.track_running_job():
+                profile_name = self.select_encoding_profile()
+                size = self.get_render_size(targets or [Config.DEFAULT_OUTPUT_TARGET])
+                overlay_cache = self.get_overlay_cache(targets)
+                if overlay_cache is None:
+                    overlay_cache = self.create_job_overlay_cache(size)
+
+                with self.create_overlay_clips(size) as overlays:
+                    for job in jobs:
+                        task_id = job['task_id']
+                        image_path = os.path.join(self.UPLOAD_FOLDER, f"{chat_id}_{task_id}_image.jpg")
+                        try:
+                            with self.create_clips(image_path, overlays) as clips:
+                                self.render_video(chat_id, task_id, image_path, clips,
+                                                  job['startFrame'], job['endFrame'],
+                                                  job.get('saturation', -10), profile_name, overlay_cache,
+                                                  targets)
+                        except Exception as e:
+                            logger.error(f"Error in process_batch for task {task_id}: {e}")
+                            self.update_task_status(chat_id, task_id, 'error', 0)
+
+        except Exception as e:
+            logger.error(f"Error in process_batch for batch {batch_id}: {e}")
+            for job in jobs:
+                if self.user_tasks.get(chat_id, {}).get(job['task_id'], {}).get('status') != 'completed':
+                    self.update_task_status(chat_id, job['task_id'], 'error', 0)
+            raise
+        finally:
+            self.create_batch_completion_flag(chat_id, batch_id)
+
     def generate_video(self):
         chat_id = None
         task_id = None
@@ -272,6 +705,7 @@ class VideoGeneratorApp:
             start_frame = data.get('startFrame')
             end_frame = data.get('endFrame')
             saturation_value = data.get('saturation', -10)  # Значение по умолчанию -10
+            targets = self.parse_output_targets(data.get('targets'))
 
             if not all([start_frame, end_frame, chat_id, task_id]):
                 raise ValueError("Missing required parameters")
@@ -306,7 +740,8 @@ class VideoGeneratorApp:
                 image_path,
                 start_frame,
                 end_frame,
-                saturation_value
+                saturation_value,
+                targets
             )
 
             return jsonify({'success': True, 'message': 'Video generation started'})
@@ -317,6 +752,67 @@ class VideoGeneratorApp:
                 self.update_task_status(chat_id, task_id, 'error', 0)
             return jsonify({'success': False, 'message': str(e)})
 
+    def generate_batch(self):
+        chat_id = None
+        task_ids = []
+        try:
+            data = request.json
+            if not data:
+                raise ValueError("No data provided")
+
+            chat_id = data.get('chat_id')
+            batch_id = data.get('batch_id')
+            jobs = data.get('jobs')
+            targets = self.parse_output_targets(data.get('targets'))
+
+            if not all([chat_id, batch_id, jobs]):
+                raise ValueError("Missing required parameters")
+
+            batch_task_ids = self.load_batch_task_ids(chat_id, batch_id)
+            for job in jobs:
+                if job.get('task_id') not in batch_task_ids:
+                    raise ValueError(f"Task {job.get('task_id')} is not part of batch {batch_id}")
+                if not all([job.get('startFrame'), job.get('endFrame')]):
+                    raise ValueError("Missing required parameters")
+            if len({job['task_id'] for job in jobs}) != len(jobs):
+                raise ValueError("Duplicate task_id in batch jobs")
+
+            if self.executor._work_queue.qsize() >= Config.MAX_QUEUE_SIZE:
+                raise ValueError("Server is busy. Please wait a moment and try again.")
+
+            with self.user_tasks_lock:
+                active_tasks = sum(1 for task in self.user_tasks.get(chat_id, {}).values()
+                                 if task['status'] in ['pending', 'processing'])
+
+                # Каждое изображение альбома считается отдельной активной задачей
+                if active_tasks + len(jobs) > Config.MAX_ACTIVE_TASKS:
+                    raise ValueError(
+                        f"Too many active tasks: {active_tasks} active, {len(jobs)} in batch, "
+                        f"limit {Config.MAX_ACTIVE_TASKS}. Please wait for some tasks to complete."
+                    )
+
+                task_ids = [job['task_id'] for job in jobs]
+                if chat_id not in self.user_tasks:
+                    self.user_tasks[chat_id] = {}
+
+                for task_id in task_ids:
+                    self.user_tasks[chat_id][task_id] = {
+                        'status': 'pending',
+                        'progress': 0,
+                        'created_at': time.time()
+                    }
+
+            # Весь альбом занимает один слот пула
+            self.executor.submit(self.process_batch, chat_id, batch_id, jobs, targets)
+
+            return jsonify({'success': True, 'message': 'Batch generation started'})
+
+        except Exception as e:
+            logger.error(f"Error generating batch: {e}")
+            for task_id in task_ids:
+                self.update_task_status(chat_id, task_id, 'error', 0)
+            return jsonify({'success': False, 'message': str(e)})
+
     def update_task_status(self, chat_id, task_id, status, progress):
         with self.user_tasks_lock:
             if chat_id in self.user_tasks:
@@ -330,9 +826,35 @@ class VideoGeneratorApp:
         with open(done_flag_path, 'w') as f:
             f.write('done')
 
+    def create_batch_completion_flag(self, chat_id, batch_id):
+        done_flag_path = os.path.join(self.UPLOAD_FOLDER, f"{chat_id}_{batch_id}_batch_done.txt")
+        with open(done_flag_path, 'w') as f:
+            f.write('done')
+
+    def load_batch_task_ids(self, chat_id, batch_id):
+        """Список задач альбома из манифеста, который пишет бот"""
+        manifest_path = os.path.join(self.UPLOAD_FOLDER, f"{chat_id}_{batch_id}_batch.json")
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"Batch not found for chat_id: {chat_id}, batch_id: {batch_id}")
+        with open(manifest_path) as f:
+            return json.load(f)['task_ids']
+
     def cropper(self, chat_id, task_id):
         try:
-            return render_template('cropper.html', chat_id=chat_id, task_id=task_id)
+            return render_template('cropper.html', chat_id=chat_id, task_id=task_id,
+                                   task_ids=[task_id], batch_id=None)
+        except Exception as e:
+            logger.error(f"Error rendering cropper template: {e}")
+            return jsonify({'error': 'Internal server error'}), 500
+
+    def batch_cropper(self, chat_id, batch_id):
+        try:
+            task_ids = self.load_batch_task_ids(chat_id, batch_id)
+            return render_template('cropper.html', chat_id=chat_id, task_id=task_ids[0],
+                                   task_ids=task_ids, batch_id=batch_id)
+        except FileNotFoundError as e:
+            logger.error(f"Error loading batch: {e}")
+            return jsonify({'error': 'Batch not found'}), 404
         except Exception as e:
             logger.error(f"Error rendering cropper template: {e}")
             return jsonify({'error': 'Internal server error'}), 500
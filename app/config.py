@@ -8,11 +8,16 @@ class Config:
     # Telegram Bot
     BOT_TOKEN = os.getenv('BOT_TOKEN')
     BASE_WEBAPP_URL = os.getenv('BASE_WEBAPP_URL')
+    # Альтернативный Bot API сервер (локальный или тестовый из app.loadtest)
+    BOT_API_URL = os.getenv('BOT_API_URL')
+    BOT_API_FILE_URL = os.getenv('BOT_API_FILE_URL')
 
     # Paths
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
     STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
+    # Служебные файлы рендера; в отличие от static, Flask эту папку не раздает
+    CACHE_FOLDER = os.path.join(BASE_DIR, 'cache')
     TEMPLATE_FOLDER = os.path.join(BASE_DIR, 'templates')
     
 
@@ -24,9 +29,35 @@ class Config:
     VIDEO_PING_PONG = True
     VIDEO_FPS = 25
     VIDEO_CODEC = 'libx264'
-    VIDEO_PRESET = 'ultrafast'
     VIDEO_THREADS = 12
+
+    # Encoding Profiles
+    # Профиль выбирается автоматически по загрузке очереди,
+    # VIDEO_PROFILE в .env принудительно задает профиль
+    VIDEO_PROFILE = os.getenv('VIDEO_PROFILE')
+    VIDEO_PROFILES = {
+        'fast': {'preset': 'veryfast', 'crf': 26},
+        'balanced': {'preset': 'medium', 'crf': 24},
+        'small': {'preset': 'slow', 'crf': 27, 'maxrate': '3M', 'bufsize': '6M'},
+    }
+    # Загрузка - задания пула в работе и в очереди (альбом - одно задание)
+    VIDEO_PROFILE_BUSY_LOAD = 4  # заданий, начиная с которых используется 'fast'
+    VIDEO_PROFILE_IDLE_LOAD = 1  # заданий, до которых используется 'small'
+    ENCODE_STATS_FILE = os.path.join(BASE_DIR, 'encode_stats.jsonl')
+    MAX_VIDEO_SIZE = 50 * 1024 * 1024  # лимит Telegram для send_video
     
+    # Warm-up
+    PRELOAD_OVERLAY_FRAMES = True  # держать кадры наложений основного размера в памяти
+    # Лимит кэша кадров наложений одного альбома или воркера app.render, когда кадр
+    # композитинга больше основного и нет хранилища этого размера
+    # (полный набор в размере story занимает около 1.1 ГБ)
+    OVERLAY_CACHE_MAX_BYTES = 128 * 1024 * 1024
+    # Готовые кадры наложений на диске (python -m app.overlay_store build)
+    OVERLAY_STORE_PATH = os.path.join(CACHE_FOLDER, 'overlay_store')
+    # Собирать, если отсутствует или устарело: при прогреве - в основном размере,
+    # в app.render - в размере композитинга выбранных форматов
+    OVERLAY_STORE_AUTO_BUILD = True
+
     # Monitoring Settings
     MAX_VIDEO_PROCESSING_TIME = 300 # 5 минут
     MAX_WAIT_TIME = 300  # 5 минут
@@ -35,12 +66,27 @@ class Config:
     VIDEO_CHECK_RETRIES = 3
     VIDEO_CHECK_DELAY = 1
 
+    # Albums (media groups)
+    MEDIA_GROUP_WAIT = 1.5  # секунд ожидания остальных изображений альбома
+    BATCH_WAIT_TIME_PER_IMAGE = 60  # добавка к MAX_WAIT_TIME на каждое изображение альбома
+
     MAX_ACTIVE_TASKS = 8
     MAX_QUEUE_SIZE = 10
     MAX_FILE_AGE = 3600  # 1 час
     # Output Video Dimensions
     VIDEO_WIDTH = 768
     VIDEO_HEIGHT = 1024
+
+    # Output Targets
+    # Все форматы вырезаются по центру из одного кадра с пропорциями
+    # VIDEO_WIDTH:VIDEO_HEIGHT, композитинг выполняется один раз
+    DEFAULT_OUTPUT_TARGET = 'default'
+    OUTPUT_TARGETS = {
+        'default': {'width': VIDEO_WIDTH, 'height': VIDEO_HEIGHT},
+        'story': {'width': 1080, 'height': 1920},
+        'square': {'width': 1080, 'height': 1080},
+        'animation': {'width': 480, 'height': 640, 'fps': 15, 'animation': True},
+    }
     
 
     
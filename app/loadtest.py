@@ -0,0 +1,517 @@
+# loadtest.py
+"""Сквозной нагрузочный тест без Telegram.
+
+Использование:
+    python -m app.loadtest [--users N] [--arrival-interval S] [--latency MS] [--retry-after-rate P]
+
+Поднимает локальный сервер, имитирующий Bot API (getUpdates, getFile, скачивание файлов,
+sendMessage, sendVideo, sendDocument, sendAnimation, sendMediaGroup), и запускает бота
+отдельным процессом с BOT_API_URL, указывающим на него. Каждый синтетический пользователь
+проходит весь путь: фото -> handle_image -> /generate_video -> рендер ->
+monitor_user_tasks -> send_video_to_user.
+
+Сервер добавляет настраиваемую задержку к каждому ответу и с заданной вероятностью
+отвечает 429 (RetryAfter) на загрузки. В конце выводятся p50/p95/p99 сквозной задержки,
+пропускная способность, доли ошибок и потребление ресурсов процессом бота.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image
+
+from .config import Config
+
+PROJECT_ROOT = os.path.dirname(Config.BASE_DIR)
+BOT_TOKEN = '123456:LOADTEST'
+UPLOAD_METHODS = {'sendVideo', 'sendDocument', 'sendAnimation', 'sendMediaGroup'}
+DELIVERY_METHODS = {'sendVideo', 'sendDocument', 'sendMediaGroup'}
+CROPPER_URL_PATTERN = re.compile(r'/cropper/(?P<chat_id>-?\d+)/(?P<task_id>[\w-]+)')
+
+
+def make_test_image(width=1280, height=960, seed=0):
+    rng = np.random.RandomState(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = rng.randint(0, 64, (height, width, 3))
+    image = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    # Метод ближайшего ранга
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return round(ordered[rank - 1], 3)
+
+
+class FakeBotApi:
+    """Состояние поддельного Bot API: очередь обновлений, файлы и принятые отправки"""
+
+    def __init__(self, latency=0.0, jitter=0.0, retry_after_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+
+        self.lock = threading.Condition()
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1000
+        self.files = {}
+        self.events = {}  # chat_id -> список (время, метод, параметры)
+        self.request_counts = {}
+        self.injected_retry_after = 0
+        self.uploaded_bytes = 0
+        self.polling_started = threading.Event()
+
+    def add_update(self, update):
+        with self.lock:
+            update['update_id'] = self.next_update_id
+            self.next_update_id += 1
+            self.updates.append(update)
+            self.lock.notify_all()
+
+    def get_updates(self, offset, timeout):
+        deadline = time.time() + timeout
+        with self.lock:
+            while True:
+                self.updates = [u for u in self.updates if u['update_id'] >= offset]
+                if self.updates or time.time() >= deadline:
+                    return list(self.updates)
+                self.lock.wait(deadline - time.time())
+
+    def new_message(self, chat_id, **fields):
+        with self.lock:
+            self.next_message_id += 1
+            message_id = self.next_message_id
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            **fields
+        }
+
+    def record(self, chat_id, method, params):
+        with self.lock:
+            self.events.setdefault(chat_id, []).append((time.time(), method, params))
+            self.lock.notify_all()
+
+    def wait_for(self, chat_id, predicate, timeout):
+        """Ожидание события чата, удовлетворяющего predicate(method, params)"""
+        deadline = time.time() + timeout
+        seen = 0
+        with self.lock:
+            while True:
+                events = self.events.get(chat_id, [])
+                for event in events[seen:]:
+                    if predicate(event[1], event[2]):
+                        return event
+                seen = len(events)
+                if time.time() >= deadline:
+                    return None
+                self.lock.wait(deadline - time.time())
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    api: FakeBotApi = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Бот остановлен во время long polling
+            pass
+
+    def _read_params(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        params = {}
+
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                payload = part.get_payload(decode=True) or b''
+                if part.get_filename():
+                    params[name] = {'filename': part.get_filename(), 'size': len(payload)}
+                    self.api.uploaded_bytes += len(payload)
+                else:
+                    params[name] = payload.decode()
+        elif content_type.startswith('application/json'):
+            params = json.loads(body or b'{}')
+        else:
+            params = {k: v[0] for k, v in urllib.parse.parse_qs(body.decode()).items()}
+
+        for key, value in list(params.items()):
+            if isinstance(value, str) and value[:1] in ('[', '{'):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    pass
+        return params
+
+    def do_GET(self):
+        match = re.match(r'^/file/bot[^/]+/(?P<path>.+)$', self.path)
+        if not match or match.group('path') not in self.api.files:
+            self.send_error(404)
+            return
+        self._delay()
+        data = self.api.files[match.group('path')]
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        match = re.match(r'^/bot[^/]+/(?P<method>\w+)$', self.path)
+        if not match:
+            self.send_error(404)
+            return
+        method = match.group('method')
+        params = self._read_params()
+        api = self.api
+
+        with api.lock:
+            api.request_counts[method] = api.request_counts.get(method, 0) + 1
+
+        if method == 'getUpdates':
+            api.polling_started.set()
+            updates = api.get_updates(int(params.get('offset') or 0), min(float(params.get('timeout') or 0), 1.0))
+            self._send_json({'ok': True, 'result': updates})
+            return
+
+        self._delay()
+
+        if method in UPLOAD_METHODS and random.random() < api.retry_after_rate:
+            with api.lock:
+                api.injected_retry_after += 1
+            self._send_json({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {api.retry_after}",
+                'parameters': {'retry_after': api.retry_after}
+            }, status=429)
+            return
+
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+        if chat_id is not None:
+            api.record(chat_id, method, params)
+
+        if method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'LoadTestBot', 'username': 'loadtest_bot'}
+        elif method == 'getFile':
+            file_id = params['file_id']
+            result = {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_size': len(api.files[f"photos/{file_id}.jpg"]),
+                'file_path': f"photos/{file_id}.jpg"
+            }
+        elif method == 'sendMediaGroup':
+            result = [api.new_message(chat_id) for _ in params.get('media', [])]
+        elif method in UPLOAD_METHODS or method == 'sendMessage':
+            result = api.new_message(chat_id, text=params.get('text'))
+        else:
+            # deleteWebhook, answerCallbackQuery, editMessageText и прочее
+            result = True
+        self._send_json({'ok': True, 'result': result})
+
+    def _delay(self):
+        delay = self.api.latency + random.uniform(0, self.api.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ProcessMonitor(threading.Thread):
+    """Периодический замер RSS и CPU процесса бота через /proc"""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        while not self.stopped.wait(self.interval):
+            try:
+                with open(f"/proc/{self.pid}/stat") as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                with open(f"/proc/{self.pid}/status") as f:
+                    rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+            except (OSError, StopIteration):
+                break
+            cpu_seconds = (int(fields[11]) + int(fields[12])) / clock_ticks
+            self.samples.append((time.time(), cpu_seconds, rss_kb))
+
+    def summary(self):
+        if not self.samples:
+            return {}
+        return {
+            'peak_rss_mb': round(max(s[2] for s in self.samples) / 1024, 1),
+            'mean_rss_mb': round(statistics.mean(s[2] for s in self.samples) / 1024, 1),
+            'cpu_seconds': round(self.samples[-1][1], 2)
+        }
+
+
+class SyntheticUser(threading.Thread):
+    def __init__(self, api, chat_id, webapp_url, timeout):
+        super().__init__(daemon=True)
+        self.api = api
+        self.chat_id = chat_id
+        self.webapp_url = webapp_url
+        self.timeout = timeout
+        self.result = {'chat_id': chat_id, 'outcome': 'pending'}
+
+    def run(self):
+        user = {'id': self.chat_id, 'is_bot': False, 'first_name': f"User{self.chat_id}"}
+        chat = {'id': self.chat_id, 'type': 'private'}
+        file_id = f"photo{self.chat_id}"
+        self.api.files[f"photos/{file_id}.jpg"] = make_test_image(seed=self.chat_id)
+
+        self.api.add_update({'callback_query': {
+            'id': f"cq{self.chat_id}",
+            'from': user,
+            'chat_instance': str(self.chat_id),
+            'data': 'create_plasma',
+            'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'text': 'menu'}
+        }})
+
+        started = time.time()
+        self.api.add_update({'message': {
+            'message_id': 2,
+            'date': int(started),
+            'chat': chat,
+            'from': user,
+            'photo': [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 960}]
+        }})
+
+        # 1. Ссылка на редактор от handle_image
+        event = self.api.wait_for(
+            self.chat_id,
+            lambda method, params: method == 'sendMessage' and CROPPER_URL_PATTERN.search(
+                json.dumps(params.get('reply_markup') or {})),
+            self.timeout
+        )
+        if event is None:
+            self.result['outcome'] = 'no_editor_link'
+            return
+        link_time = event[0]
+        task_id = CROPPER_URL_PATTERN.search(json.dumps(event[2]['reply_markup'])).group('task_id')
+
+        # 2. Пользователь настраивает кадр и нажимает "Создать"
+        submit_time = time.time()
+        body = json.dumps({
+            'chat_id': str(self.chat_id),
+            'task_id': task_id,
+            'startFrame': {'x': 0, 'y': 0, 'width': 720, 'height': 960},
+            'endFrame': {'x': 280, 'y': 120, 'width': 540, 'height': 720},
+            'saturation': -10
+        }).encode()
+        request = urllib.request.Request(f"{self.webapp_url}/generate_video", data=body,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                reply = json.load(response)
+        except (urllib.error.URLError, ConnectionError) as e:
+            self.result.update({'outcome': 'generate_http_error', 'error': str(e)})
+            return
+        if not reply.get('success'):
+            self.result.update({'outcome': 'generate_rejected', 'error': reply.get('message')})
+            return
+
+        # 3. Видео или сообщение об ошибке/таймауте от monitor_user_tasks
+        event = self.api.wait_for(
+            self.chat_id,
+            lambda method, params: method in DELIVERY_METHODS or (
+                method == 'sendMessage' and str(params.get('text', '')).startswith(('😕', '⏰'))),
+            self.timeout
+        )
+        if event is None:
+            self.result['outcome'] = 'timeout'
+            return
+
+        delivered_time, method, params = event
+        self.result.update({
+            'outcome': 'delivered' if method in DELIVERY_METHODS else 'bot_error',
+            'method': method,
+            'e2e_latency': delivered_time - started,
+            'editor_link_latency': link_time - started,
+            'render_latency': delivered_time - submit_time
+        })
+
+
+def start_bot(api_port, workdir):
+    env = dict(
+        os.environ,
+        PYTHONPATH=PROJECT_ROOT,
+        BOT_TOKEN=BOT_TOKEN,
+        BASE_WEBAPP_URL='http://127.0.0.1:5000',
+        BOT_API_URL=f"http://127.0.0.1:{api_port}/bot",
+        BOT_API_FILE_URL=f"http://127.0.0.1:{api_port}/file/bot"
+    )
+    log = open(os.path.join(workdir, 'bot_stdout.log'), 'w')
+    return subprocess.Popen([sys.executable, '-m', 'app.plazmoid_bot'], cwd=workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(api, webapp_url, timeout):
+    deadline = time.time() + timeout
+    if not api.polling_started.wait(timeout):
+        raise TimeoutError("Bot did not start polling")
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{webapp_url}/health", timeout=1) as response:
+                if json.load(response)['status'] == 'ready':
+                    return
+        except urllib.error.HTTPError:
+            pass
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.2)
+    raise TimeoutError("Web app did not become ready")
+
+
+def build_report(results, wall_time, api, monitor, rusage_before):
+    latencies = [r['e2e_latency'] for r in results if r['outcome'] == 'delivered']
+    outcomes = {}
+    for r in results:
+        outcomes[r['outcome']] = outcomes.get(r['outcome'], 0) + 1
+
+    rusage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    def latency_stats(key):
+        values = [r[key] for r in results if r['outcome'] == 'delivered']
+        return {
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'mean': round(statistics.mean(values), 3) if values else None
+        }
+
+    return {
+        'users': len(results),
+        'wall_time': round(wall_time, 2),
+        'throughput_per_min': round(len(latencies) / wall_time * 60, 2) if wall_time else 0,
+        'outcomes': outcomes,
+        'error_rate': round(1 - len(latencies) / len(results), 4) if results else 0,
+        'e2e_latency': latency_stats('e2e_latency'),
+        'editor_link_latency': latency_stats('editor_link_latency'),
+        'render_latency': latency_stats('render_latency'),
+        'delivery_methods': {
+            m: sum(1 for r in results if r.get('method') == m) for m in sorted(DELIVERY_METHODS)
+        },
+        'api_requests': dict(sorted(api.request_counts.items())),
+        'injected_retry_after': api.injected_retry_after,
+        'uploaded_mb': round(api.uploaded_bytes / 1024 / 1024, 2),
+        'bot_process': monitor.summary(),
+        # Процесс бота и дочерние ffmpeg после завершения
+        'children_cpu_seconds': round(
+            (rusage_after.ru_utime + rusage_after.ru_stime) - (rusage_before.ru_utime + rusage_before.ru_stime), 2),
+        'children_peak_rss_mb': round(rusage_after.ru_maxrss / 1024, 1)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.loadtest',
+                                     description='Offline end-to-end load test against a fake Bot API server')
+    parser.add_argument('--users', type=int, default=5, help='number of synthetic users')
+    parser.add_argument('--arrival-interval', type=float, default=1.0, help='seconds between user arrivals')
+    parser.add_argument('--latency', type=float, default=50, help='fake API latency per request, ms')
+    parser.add_argument('--jitter', type=float, default=50, help='extra random latency per request, ms')
+    parser.add_argument('--retry-after-rate', type=float, default=0.0,
+                        help='probability of a 429 RetryAfter reply to an upload')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after value in injected 429 replies')
+    parser.add_argument('--api-port', type=int, default=8081, help='port for the fake Bot API server')
+    parser.add_argument('--timeout', type=float, default=Config.MAX_WAIT_TIME + 60,
+                        help='per-user timeout, seconds')
+    parser.add_argument('--report-json', help='write the report to this file')
+    args = parser.parse_args(argv)
+
+    api = FakeBotApi(args.latency / 1000, args.jitter / 1000, args.retry_after_rate, args.retry_after)
+    FakeBotApiHandler.api = api
+    server = ThreadingHTTPServer(('127.0.0.1', args.api_port), FakeBotApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    webapp_url = 'http://127.0.0.1:5000'
+    rusage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot_process = start_bot(args.api_port, workdir)
+        monitor = ProcessMonitor(bot_process.pid)
+        monitor.start()
+        try:
+            startup = time.time()
+            wait_until_ready(api, webapp_url, timeout=300)
+            print(f"Bot ready in {time.time() - startup:.2f}s, starting {args.users} users", flush=True)
+
+            users = []
+            wall_start = time.time()
+            for index in range(args.users):
+                user = SyntheticUser(api, 10000 + index, webapp_url, args.timeout)
+                user.start()
+                users.append(user)
+                time.sleep(args.arrival_interval)
+
+            for user in users:
+                user.join()
+                result = user.result
+                latency = f"{result['e2e_latency']:.2f}s" if 'e2e_latency' in result else '-'
+                print(f"user {result['chat_id']}: {result['outcome']} {latency}", flush=True)
+            wall_time = time.time() - wall_start
+        finally:
+            monitor.stopped.set()
+            bot_process.terminate()
+            try:
+                bot_process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                bot_process.kill()
+                bot_process.wait()
+            server.shutdown()
+
+    report = build_report([u.result for u in users], wall_time, api, monitor, rusage_before)
+    print(json.dumps(report, indent=2))
+
+    if args.report_json:
+        with open(args.report_json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if report['error_rate'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
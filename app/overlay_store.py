@@ -0,0 +1,175 @@
+# overlay_store.py
+"""Хранилище готовых кадров наложений на диске.
+
+Использование:
+    python -m app.overlay_store build [--targets TARGET ...]  # собрать (или пересобрать устаревшее)
+    python -m app.overlay_store check [--targets TARGET ...]  # проверить актуальность
+
+Кадры наложений, уже приведенные к размеру видео (ровно то, что возвращает
+VideoGeneratorApp.get_overlay_frames), сохраняются в overlay_store.npy формы
+(слои, кадры, высота, ширина, 4). Рядом лежит overlay_store.json с версией формата,
+fps, числом кадров, размерами и хэшами исходных .mov. Коэффициенты альфы
+применяются при смешивании, поэтому кадры хранятся без них и результат рендера
+совпадает с декодированием.
+
+Рендер открывает .npy через np.memmap только для чтения: декодирования нет, а все
+процессы делят одни страницы в page cache. Хранилище считается устаревшим, если
+изменились Config.VIDEO_WIDTH/VIDEO_HEIGHT, VIDEO_FPS, VIDEO_DURATION или файлы наложений.
+
+Для дополнительных форматов (--targets) кадр композитинга больше основного, для каждого
+такого размера собирается отдельное хранилище overlay_store_<ширина>x<высота>.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+LAYERS = ('soft_light', 'screen')
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_path(size=None, path=Config.OVERLAY_STORE_PATH):
+    """Путь хранилища кадров размера size (без расширения)"""
+    if size is None or tuple(size) == (Config.VIDEO_WIDTH, Config.VIDEO_HEIGHT):
+        return path
+    return f"{path}_{size[0]}x{size[1]}"
+
+
+def expected_header(overlay_paths, size=None):
+    """Заголовок, которому должно соответствовать актуальное хранилище"""
+    width, height = size or (Config.VIDEO_WIDTH, Config.VIDEO_HEIGHT)
+    return {
+        'version': STORE_VERSION,
+        'fps': Config.VIDEO_FPS,
+        'duration': Config.VIDEO_DURATION,
+        'frame_count': len(np.arange(0, Config.VIDEO_DURATION, 1.0 / Config.VIDEO_FPS)),
+        'width': width,
+        'height': height,
+        'layers': list(LAYERS),
+        'sources': {layer: _file_sha256(overlay_paths[layer]) for layer in LAYERS}
+    }
+
+
+def check_store(overlay_paths, size=None, path=None):
+    """Причина, по которой хранилище нельзя использовать, или None"""
+    path = path or store_path(size)
+    header_path = f"{path}.json"
+    if not os.path.exists(header_path) or not os.path.exists(f"{path}.npy"):
+        return 'missing'
+    with open(header_path) as f:
+        header = json.load(f)
+    expected = expected_header(overlay_paths, size)
+    for key, value in expected.items():
+        if header.get(key) != value:
+            return f"stale: {key} changed"
+    return None
+
+
+class OverlayStore:
+    def __init__(self, header, frames):
+        self.header = header
+        self.frames = frames
+        self.size = (header['width'], header['height'])
+
+    def covers(self, size):
+        return size is None or tuple(size) == self.size
+
+    def get(self, t):
+        """Кадры слоев для момента t или None, если такого кадра нет"""
+        index = int(round(t * self.header['fps']))
+        if index >= self.header['frame_count'] or abs(index / self.header['fps'] - t) > 1e-6:
+            return None
+        return tuple(self.frames[layer, index] for layer in range(len(LAYERS)))
+
+
+def load_store(overlay_paths, size=None, path=None):
+    path = path or store_path(size)
+    reason = check_store(overlay_paths, size, path)
+    if reason:
+        logger.warning(f"Overlay store not used ({reason}), overlays will be decoded")
+        return None
+
+    with open(f"{path}.json") as f:
+        header = json.load(f)
+    frames = np.load(f"{path}.npy", mmap_mode='r')
+    logger.info(f"Loaded overlay store: {header['frame_count']} frames {header['width']}x{header['height']}")
+    return OverlayStore(header, frames)
+
+
+def build_store(app, size=None, path=None):
+    """Декодирование наложений и запись хранилища; запись атомарная"""
+    path = path or store_path(size)
+    header = expected_header(app.overlay_paths, size)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp.npy"
+    shape = (len(LAYERS), header['frame_count'], header['height'], header['width'], 4)
+
+    frames = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.uint8, shape=shape)
+    try:
+        with app.create_overlay_clips(decode=True) as overlays:
+            for index, t in enumerate(np.arange(0, Config.VIDEO_DURATION, 1.0 / Config.VIDEO_FPS)):
+                layer_frames = app.get_overlay_frames(t, overlays, size=(header['width'], header['height']))
+                for layer, frame in enumerate(layer_frames):
+                    frames[layer, index] = frame
+        frames.flush()
+    finally:
+        del frames
+
+    if os.path.exists(f"{path}.json"):
+        os.remove(f"{path}.json")
+    os.replace(temp_path, f"{path}.npy")
+    # Заголовок пишется последним: без него хранилище считается отсутствующим
+    with open(f"{path}.json.tmp", 'w') as f:
+        json.dump(header, f, indent=2)
+    os.replace(f"{path}.json.tmp", f"{path}.json")
+    logger.info(f"Built overlay store {path}.npy: {shape}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.overlay_store',
+                                     description='Build or check the pre-decoded overlay frame store')
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--targets', nargs='+', default=[], choices=sorted(Config.OUTPUT_TARGETS),
+                        help='also handle the compositing sizes of these extra output formats')
+    parser.add_argument('--force', action='store_true', help='rebuild even if the store is up to date')
+    args = parser.parse_args(argv)
+
+    from .app import VideoGeneratorApp
+
+    app = VideoGeneratorApp(warm_up=False)
+    app._check_overlay_files()
+    sizes = app.get_store_sizes(args.targets)
+
+    status = 0
+    for size in sizes:
+        name = f"{size[0]}x{size[1]}"
+        reason = check_store(app.overlay_paths, size)
+        if args.command == 'check':
+            print(f"{name}: {reason or 'up to date'}")
+            status = 1 if reason else status
+        elif reason is None and not args.force:
+            print(f"{name}: up to date")
+        else:
+            build_store(app, size)
+            print(f"{name}: built")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
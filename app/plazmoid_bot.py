@@ -1,14 +1,15 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, InputMediaVideo
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 import os
 import asyncio
+import json
 import logging
 from threading import Thread
 from .config import Config
-from .app import VideoGeneratorApp
 import uuid
 import time
-from typing import Dict, Optional, Set
+from typing import Dict, List, Optional, Set
+from contextlib import ExitStack
 from dataclasses import dataclass
 from enum import Enum
 
@@ -34,8 +35,12 @@ class Task:
     status: TaskStatus
     start_time: float
     message_id: Optional[int] = None
+    batch_id: Optional[str] = None
 
 def run_flask():
+    # Импорт внутри потока: бот начинает отвечать, не дожидаясь модулей рендера
+    from .app import VideoGeneratorApp
+
     app_instance = VideoGeneratorApp()
     app_instance.run()
 
@@ -44,7 +49,12 @@ class ImageBot:
         try:
             if not token:
                 raise ValueError("Bot token is not provided")
-            self.application = ApplicationBuilder().token(token).build()
+            builder = ApplicationBuilder().token(token)
+            if Config.BOT_API_URL:
+                builder = builder.base_url(Config.BOT_API_URL)
+            if Config.BOT_API_FILE_URL:
+                builder = builder.base_file_url(Config.BOT_API_FILE_URL)
+            self.application = builder.build()
         except Exception as e:
             logger.critical(f"Failed to initialize bot: {e}")
             raise
@@ -56,6 +66,7 @@ class ImageBot:
         self.user_states: Dict[int, str] = {}
         self.user_tasks: Dict[int, Dict[str, Task]] = {}
         self.monitoring_tasks: Set[int] = set()
+        self.media_groups: Dict[str, dict] = {}
         
         self._start_flask_server()
 
@@ -130,8 +141,10 @@ class ImageBot:
         message_id = update.message.message_id
     
         if self.user_states.get(user_id) == 'awaiting_image':
+            media_group = None
             try:
                 task_id = str(uuid.uuid4())
+                media_group = self._get_media_group(update.message) if update.message.media_group_id else None
     
                 if chat_id not in self.user_tasks:
                     self.user_tasks[chat_id] = {}
@@ -139,15 +152,24 @@ class ImageBot:
                 self.user_tasks[chat_id][task_id] = Task(
                     status=TaskStatus.PENDING,
                     start_time=time.time(),
-                    message_id=message_id
+                    message_id=message_id,
+                    batch_id=media_group['batch_id'] if media_group else None
                 )
-    
+
+                if media_group:
+                    # Регистрация до первого await: пока идет загрузка, альбом не завершится
+                    media_group['tasks'].append((message_id, task_id))
+                    media_group['pending'] += 1
+                    media_group['last_update'] = time.time()
+
                 if update.message.photo:
                     photo = update.message.photo[-1]
                     file = await photo.get_file()
                 elif update.message.document and update.message.document.mime_type.startswith('image/'):
                     file = await update.message.document.get_file()
                 else:
+                    self._leave_media_group(media_group, message_id, task_id)
+                    self.user_tasks[chat_id][task_id].status = TaskStatus.ERROR
                     await update.message.reply_text(
                         "Пожалуйста, отправьте изображение в виде фото или документа."
                     )
@@ -157,6 +179,12 @@ class ImageBot:
                 await file.download_to_drive(file_path)
                 await self.create_monitoring_task(chat_id)
 
+                if media_group:
+                    # Ссылку на редактор отправит _finish_media_group, одну на весь альбом
+                    media_group['pending'] -= 1
+                    media_group['last_update'] = time.time()
+                    return
+
                 keyboard = [[
                     InlineKeyboardButton(
                         "🎬 Открыть редактор",
@@ -176,6 +204,8 @@ class ImageBot:
 
             except Exception as e:
                 logger.error(f"Error handling image: {e}")
+                if media_group:
+                    self._leave_media_group(media_group, message_id, task_id)
                 if chat_id in self.user_tasks and task_id in self.user_tasks[chat_id]:
                     self.user_tasks[chat_id][task_id].status = TaskStatus.ERROR
                 await update.message.reply_text(
@@ -188,6 +218,74 @@ class ImageBot:
                 "Нажмите /start, чтобы начать."
             )
 
+    def _get_media_group(self, message) -> dict:
+        media_group = self.media_groups.get(message.media_group_id)
+        if media_group is None:
+            media_group = {
+                'batch_id': str(uuid.uuid4()),
+                'chat_id': message.chat_id,
+                'message': message,
+                'tasks': [],
+                'pending': 0,
+                'last_update': time.time()
+            }
+            self.media_groups[message.media_group_id] = media_group
+            asyncio.create_task(self._finish_media_group(message.media_group_id))
+        return media_group
+
+    @staticmethod
+    def _leave_media_group(media_group: Optional[dict], message_id: int, task_id: str):
+        """Исключение изображения из альбома, если его не удалось загрузить"""
+        if media_group and (message_id, task_id) in media_group['tasks']:
+            media_group['tasks'].remove((message_id, task_id))
+            media_group['pending'] -= 1
+            media_group['last_update'] = time.time()
+
+    async def _finish_media_group(self, media_group_id: str):
+        """Ожидание всех изображений альбома и отправка одной ссылки на редактор"""
+        media_group = self.media_groups[media_group_id]
+        try:
+            # Ждем тишины после последнего изображения и окончания всех загрузок
+            while (media_group['pending'] > 0
+                   or time.time() - media_group['last_update'] < Config.MEDIA_GROUP_WAIT):
+                await asyncio.sleep(Config.MEDIA_GROUP_WAIT / 3)
+        finally:
+            del self.media_groups[media_group_id]
+
+        chat_id = media_group['chat_id']
+        batch_id = media_group['batch_id']
+        task_ids = [task_id for _, task_id in sorted(media_group['tasks'])]
+        if not task_ids:
+            logger.warning(f"Media group {media_group_id} has no downloaded images, nothing to edit")
+            return
+
+        try:
+            manifest_path = os.path.join(self.upload_folder, f"{chat_id}_{batch_id}_batch.json")
+            with open(manifest_path, 'w') as f:
+                json.dump({'task_ids': task_ids}, f)
+
+            keyboard = [[
+                InlineKeyboardButton(
+                    "🎬 Открыть редактор",
+                    web_app=WebAppInfo(url=f"{self.base_webapp_url}/batch_cropper/{chat_id}/{batch_id}")
+                )
+            ]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+
+            await media_group['message'].reply_text(
+                f"🎨 Альбом получен: {len(task_ids)} изображений!\n"
+                "1. Откройте редактор\n"
+                "2. Настройте анимацию для каждого изображения\n"
+                "3. Нажмите 'Создать'\n\n"
+                "Все видео придут одним альбомом.",
+                reply_markup=reply_markup
+            )
+        except Exception as e:
+            logger.error(f"Error finishing media group {media_group_id}: {e}")
+            for task_id in task_ids:
+                self.user_tasks[chat_id][task_id].status = TaskStatus.ERROR
+            await self.send_error_message(chat_id)
+
     async def send_video_to_user(self, chat_id: int, video_path: str, task_id: str):
         task = self.user_tasks[chat_id].get(task_id)
         if task and task.status == TaskStatus.COMPLETED:
@@ -196,9 +294,9 @@ class ImageBot:
     
         try:
             file_size = os.path.getsize(video_path)
-            MAX_VIDEO_SIZE = 50 * 1024 * 1024
+            upload_start = time.time()
     
-            if file_size <= MAX_VIDEO_SIZE:
+            if file_size <= Config.MAX_VIDEO_SIZE:
                 try:
                     with open(video_path, 'rb') as video_file:
                         await self.application.bot.send_video(
@@ -209,7 +307,8 @@ class ImageBot:
                             supports_streaming=True,
                             reply_to_message_id=task.message_id  # Добавляем это
                         )
-                    logger.info(f"Sent as video message for task {task_id}")
+                    logger.info(f"Sent as video message for task {task_id} "
+                                f"({file_size / 1024 / 1024:.2f} MB in {time.time() - upload_start:.2f}s)")
                     self.cleanup_old_tasks(chat_id)
                     return True
                 except Exception as e:
@@ -223,7 +322,8 @@ class ImageBot:
                     filename=f"plasma_effect_{task_id[:8]}.mp4",
                     reply_to_message_id=task.message_id  # Добавляем это
                 )
-            logger.info(f"Sent as document for task {task_id}")
+            logger.info(f"Sent as document for task {task_id} "
+                        f"({file_size / 1024 / 1024:.2f} MB in {time.time() - upload_start:.2f}s)")
             self.cleanup_old_tasks(chat_id)
             return True
     
@@ -232,6 +332,123 @@ class ImageBot:
             return False
     
 
+    async def send_extra_formats(self, chat_id: int, task_id: str):
+        """Отправка дополнительных форматов, заказанных в редакторе"""
+        task = self.user_tasks[chat_id].get(task_id)
+        for target, spec in Config.OUTPUT_TARGETS.items():
+            video_path = os.path.join(self.upload_folder, f"{chat_id}_{task_id}_video_{target}.mp4")
+            if target == Config.DEFAULT_OUTPUT_TARGET or not os.path.exists(video_path):
+                continue
+
+            try:
+                with open(video_path, 'rb') as video_file:
+                    if spec.get('animation'):
+                        await self.application.bot.send_animation(
+                            chat_id=chat_id,
+                            animation=video_file,
+                            filename=f"plasma_effect_{task_id[:8]}_{target}.mp4",
+                            reply_to_message_id=task.message_id if task else None
+                        )
+                    else:
+                        await self.application.bot.send_video(
+                            chat_id=chat_id,
+                            video=video_file,
+                            caption=f"📐 {spec['width']}x{spec['height']}",
+                            filename=f"plasma_effect_{task_id[:8]}_{target}.mp4",
+                            supports_streaming=True,
+                            reply_to_message_id=task.message_id if task else None
+                        )
+                logger.info(f"Sent {target} format for task {task_id}")
+            except Exception as e:
+                logger.warning(f"Failed to send {target} format for task {task_id}: {e}")
+
+    async def send_batch_to_user(self, chat_id: int, batch_id: str, task_ids: List[str]):
+        """Отправка видео альбома одним send_media_group"""
+        tasks = self.user_tasks[chat_id]
+        ready = []
+        for task_id in task_ids:
+            video_path = os.path.join(self.upload_folder, f"{chat_id}_{task_id}_video.mp4")
+            done_flag_path = os.path.join(self.upload_folder, f"{chat_id}_{task_id}_video_done.txt")
+            if os.path.exists(video_path) and os.path.exists(done_flag_path):
+                ready.append(task_id)
+            else:
+                tasks[task_id].status = TaskStatus.ERROR
+                await self.send_error_message(chat_id, task_id)
+
+        album = [
+            task_id for task_id in ready
+            if os.path.getsize(os.path.join(self.upload_folder, f"{chat_id}_{task_id}_video.mp4"))
+            <= Config.MAX_VIDEO_SIZE
+        ]
+
+        if len(album) >= 2:
+            try:
+                with ExitStack() as stack:
+                    media = [
+                        InputMediaVideo(
+                            media=stack.enter_context(
+                                open(os.path.join(self.upload_folder, f"{chat_id}_{task_id}_video.mp4"), 'rb')
+                            ),
+                            caption="✨ Видео готово! 🎉" if index == 0 else None,
+                            filename=f"plasma_effect_{task_id[:8]}.mp4",
+                            supports_streaming=True
+                        )
+                        for index, task_id in enumerate(album)
+                    ]
+                    await self.application.bot.send_media_group(
+                        chat_id=chat_id,
+                        media=media,
+                        reply_to_message_id=tasks[task_ids[0]].message_id
+                    )
+                for task_id in album:
+                    tasks[task_id].status = TaskStatus.COMPLETED
+                logger.info(f"Sent batch {batch_id} as media group of {len(album)} videos")
+            except Exception as e:
+                logger.warning(f"Failed to send batch {batch_id} as media group, sending one by one: {e}")
+
+        for task_id in ready:
+            if tasks[task_id].status == TaskStatus.COMPLETED:
+                continue
+            video_path = os.path.join(self.upload_folder, f"{chat_id}_{task_id}_video.mp4")
+            if await self.send_video_to_user(chat_id, video_path, task_id):
+                tasks[task_id].status = TaskStatus.COMPLETED
+            else:
+                tasks[task_id].status = TaskStatus.ERROR
+                await self.send_error_message(chat_id, task_id)
+
+        for task_id in ready:
+            if tasks[task_id].status == TaskStatus.COMPLETED:
+                await self.send_extra_formats(chat_id, task_id)
+
+        self.cleanup_old_tasks(chat_id)
+
+    async def check_batch(self, chat_id: int, batch_id: str, task_ids: List[str]):
+        done_flag_path = os.path.join(self.upload_folder, f"{chat_id}_{batch_id}_batch_done.txt")
+        tasks = self.user_tasks[chat_id]
+        start_time = min(tasks[task_id].start_time for task_id in task_ids)
+        max_wait_time = Config.MAX_WAIT_TIME + Config.BATCH_WAIT_TIME_PER_IMAGE * len(task_ids)
+
+        if os.path.exists(done_flag_path):
+            try:
+                await self.send_batch_to_user(chat_id, batch_id, task_ids)
+            except Exception as e:
+                logger.error(f"Error processing batch {batch_id}: {e}")
+                for task_id in task_ids:
+                    tasks[task_id].status = TaskStatus.ERROR
+                await self.send_error_message(chat_id)
+            finally:
+                for task_id in task_ids:
+                    await self.cleanup_task_files(chat_id, task_id)
+                await self.cleanup_batch_files(chat_id, batch_id)
+
+        elif time.time() - start_time > max_wait_time:
+            logger.warning(f"Batch {batch_id} timed out")
+            for task_id in task_ids:
+                tasks[task_id].status = TaskStatus.TIMEOUT
+                await self.cleanup_task_files(chat_id, task_id)
+            await self.send_timeout_message(chat_id)
+            await self.cleanup_batch_files(chat_id, batch_id)
+
     async def create_monitoring_task(self, chat_id: int):
         if chat_id not in self.monitoring_tasks:
             self.monitoring_tasks.add(chat_id)
@@ -258,7 +475,12 @@ class ImageBot:
                     logger.info(f"No pending tasks for chat_id: {chat_id}")
                     break
     
+                batches: Dict[str, List[str]] = {}
                 for task_id, task in tasks_to_monitor.items():
+                    if task.batch_id:
+                        batches.setdefault(task.batch_id, []).append(task_id)
+                        continue
+
                     video_path = os.path.join(self.upload_folder, f"{chat_id}_{task_id}_video.mp4")
                     done_flag_path = os.path.join(self.upload_folder, f"{chat_id}_{task_id}_video_done.txt")
     
@@ -266,6 +488,7 @@ class ImageBot:
                         try:
                             if await self.send_video_to_user(chat_id, video_path, task_id):
                                 task.status = TaskStatus.COMPLETED
+                                await self.send_extra_formats(chat_id, task_id)
                                 logger.info(f"Video processed successfully for task {task_id}")
                             else:
                                 task.status = TaskStatus.ERROR
@@ -282,6 +505,9 @@ class ImageBot:
                         task.status = TaskStatus.TIMEOUT
                         await self.send_timeout_message(chat_id, task_id)
                         await self.cleanup_task_files(chat_id, task_id)
+
+                for batch_id, batch_task_ids in batches.items():
+                    await self.check_batch(chat_id, batch_id, batch_task_ids)
     
                 await asyncio.sleep(5)
         finally:
@@ -322,6 +548,10 @@ class ImageBot:
             f"{chat_id}_{task_id}_video.mp4",
             f"{chat_id}_{task_id}_image.jpg",
             f"{chat_id}_{task_id}_video_done.txt"
+        ] + [
+            f"{chat_id}_{task_id}_video_{target}.mp4"
+            for target in Config.OUTPUT_TARGETS
+            if target != Config.DEFAULT_OUTPUT_TARGET
         ]
         
         for filename in files_to_remove:
@@ -341,6 +571,17 @@ class ImageBot:
             except Exception as e:
                 logger.error(f"Error removing file {filename}: {e}")
 
+    async def cleanup_batch_files(self, chat_id: int, batch_id: str):
+        for filename in [f"{chat_id}_{batch_id}_batch.json", f"{chat_id}_{batch_id}_batch_done.txt"]:
+            file_path = os.path.join(self.upload_folder, filename)
+            try:
+                os.remove(file_path)
+                logger.debug(f"Removed file: {filename}")
+            except FileNotFoundError:
+                logger.debug(f"File not found (already removed): {filename}")
+            except Exception as e:
+                logger.error(f"Error removing file {filename}: {e}")
+
     async def show_user_tasks(self, chat_id: int):
         if not self._has_active_tasks(chat_id):
             await self.application.bot.send_message(
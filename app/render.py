@@ -0,0 +1,246 @@
+# render.py
+"""Пакетный рендер без Telegram.
+
+Использование:
+    python -m app.render IMAGES_DIR SPEC [--output DIR] [--workers N] [--profile NAME]
+                         [--targets TARGET ...]
+
+SPEC - JSON-список или JSONL-файл с заданиями вида
+    {"image": "photo.jpg", "startFrame": {"x": 0, "y": 0, "width": 600, "height": 800},
+     "endFrame": {...}, "saturation": -10, "output": "photo.mp4"}
+Поля saturation и output необязательны. По умолчанию видео называется по имени
+изображения, а для повторяющихся изображений к имени добавляется номер задания.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+FRAME_KEYS = ('x', 'y', 'width', 'height')
+
+# Состояние процесса-воркера: приложение, открытые наложения и кэш их кадров
+_worker = {}
+
+
+def job_output_paths(job, targets=None):
+    """Пути видео задания по форматам относительно папки вывода.
+
+    Основной формат пишется в job['output'], остальные - рядом, с суффиксом формата.
+    """
+    stem = os.path.splitext(job['output'])[0]
+    return {
+        target: job['output'] if target == Config.DEFAULT_OUTPUT_TARGET else f"{stem}_{target}.mp4"
+        for target in dict.fromkeys([Config.DEFAULT_OUTPUT_TARGET, *(targets or [])])
+    }
+
+
+def load_spec(spec_path, targets=None):
+    with open(spec_path) as f:
+        content = f.read()
+
+    if content.lstrip().startswith('['):
+        jobs = json.loads(content)
+    else:
+        jobs = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    for index, job in enumerate(jobs):
+        if 'image' not in job:
+            raise ValueError(f"Job #{index}: missing 'image'")
+        for key in ('startFrame', 'endFrame'):
+            frame = job.get(key)
+            if not frame or not all(k in frame for k in FRAME_KEYS):
+                raise ValueError(f"Job #{index}: '{key}' must contain {', '.join(FRAME_KEYS)}")
+
+    # Одно изображение может встречаться несколько раз с разными кропами:
+    # тогда имя по умолчанию дополняется номером задания
+    image_counts = Counter(job['image'] for job in jobs)
+    for index, job in enumerate(jobs):
+        stem = os.path.splitext(job['image'])[0]
+        if not job.get('output'):
+            job['output'] = f"{stem}_{index}.mp4" if image_counts[job['image']] > 1 else f"{stem}.mp4"
+
+    # Проверяются все файлы, включая дополнительные форматы: a.jpg со story
+    # и a_story.jpg иначе оба писали бы a_story.mp4
+    outputs = {}
+    for index, job in enumerate(jobs):
+        for path in job_output_paths(job, targets).values():
+            output = os.path.normpath(path)
+            if output in outputs:
+                raise ValueError(f"Job #{index}: output '{path}' is already written by job #{outputs[output]}")
+            outputs[output] = index
+    return jobs
+
+
+def prepare_overlay_store(targets):
+    """Сборка хранилища кадров наложений в размере рендера до запуска воркеров"""
+    from .app import VideoGeneratorApp
+
+    app = VideoGeneratorApp(warm_up=False)
+    app._check_overlay_files()
+    size = app.get_render_size(app.parse_output_targets(targets))
+    app.load_overlay_store(size, build=Config.OVERLAY_STORE_AUTO_BUILD)
+
+
+def _init_worker(profile_name, threads, targets):
+    from .app import VideoGeneratorApp
+
+    logging.getLogger().setLevel(logging.WARNING)
+    app = VideoGeneratorApp(warm_up=False)
+    app._check_overlay_files()
+    targets = app.parse_output_targets(targets)
+    size = app.get_render_size(targets)
+    # Готовые кадры из overlay_store общие для всех воркеров через page cache
+    app.load_overlay_store(size)
+    # Клипы наложений открыты все время жизни воркера и закрываются при его
+    # штатном завершении (pool.close/join); atexit в воркерах Pool не вызывается
+    resources = ExitStack()
+    overlays = resources.enter_context(app.create_overlay_clips(size))
+    Finalize(resources, resources.close, exitpriority=10)
+    _worker.update({
+        'app': app,
+        'overlays': overlays,
+        'resources': resources,
+        'overlay_cache': app.create_job_overlay_cache(size),
+        'profile_name': profile_name,
+        'threads': threads,
+        'targets': targets
+    })
+
+
+def _render_job(args):
+    index, job, images_dir, output_dir = args
+    app = _worker['app']
+    image_path = os.path.join(images_dir, job['image'])
+    output_path = os.path.join(output_dir, job['output'])
+    output_paths = {
+        target: os.path.join(output_dir, path)
+        for target, path in job_output_paths(job, _worker['targets']).items()
+    }
+
+    start = time.time()
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with app.create_clips(image_path, _worker['overlays']) as clips:
+            if len(output_paths) == 1:
+                app.write_video(
+                    output_path, image_path, clips, job['startFrame'], job['endFrame'],
+                    job.get('saturation', -10), _worker['profile_name'], _worker['overlay_cache'],
+                    threads=_worker['threads'], moviepy_logger=None
+                )
+            else:
+                app.write_target_videos(
+                    output_paths, clips, job['startFrame'], job['endFrame'],
+                    job.get('saturation', -10), _worker['profile_name'], _worker['overlay_cache'],
+                    threads=_worker['threads']
+                )
+        return {
+            'index': index,
+            'image': job['image'],
+            'output': output_path,
+            'success': True,
+            'render_time': time.time() - start,
+            'output_bytes': sum(os.path.getsize(path) for path in output_paths.values())
+        }
+    except Exception as e:
+        return {
+            'index': index,
+            'image': job['image'],
+            'output': output_path,
+            'success': False,
+            'render_time': time.time() - start,
+            'error': str(e)
+        }
+
+
+def render_all(jobs, images_dir, output_dir, workers, profile_name, threads, targets=None):
+    os.makedirs(output_dir, exist_ok=True)
+    frames_per_video = int(Config.VIDEO_DURATION * Config.VIDEO_FPS)
+    results = []
+
+    prepare_overlay_store(targets)
+    wall_start = time.time()
+    with Pool(workers, initializer=_init_worker, initargs=(profile_name, threads, targets)) as pool:
+        tasks = [(index, job, images_dir, output_dir) for index, job in enumerate(jobs)]
+        for result in pool.imap_unordered(_render_job, tasks):
+            results.append(result)
+            prefix = f"[{len(results)}/{len(jobs)}] {result['image']}"
+            if result['success']:
+                ms_per_frame = result['render_time'] * 1000 / frames_per_video
+                print(f"{prefix} -> {result['output']} "
+                      f"({result['output_bytes'] / 1024 / 1024:.2f} MB, "
+                      f"{result['render_time']:.2f}s, {ms_per_frame:.1f} ms/frame)", flush=True)
+            else:
+                print(f"{prefix} FAILED: {result['error']}", flush=True)
+        # Штатное завершение воркеров, чтобы они закрыли клипы (выход из with вызывает terminate)
+        pool.close()
+        pool.join()
+    wall_time = time.time() - wall_start
+
+    succeeded = [r for r in results if r['success']]
+    total_frames = len(succeeded) * frames_per_video
+    summary = {
+        'jobs': len(jobs),
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'workers': workers,
+        'profile': profile_name,
+        'wall_time': round(wall_time, 3),
+        'videos_per_min': round(len(succeeded) / wall_time * 60, 2) if wall_time else 0,
+        # Время рендера кадра внутри воркера и эффективное время с учетом параллельности
+        'ms_per_frame': round(sum(r['render_time'] for r in succeeded) * 1000 / total_frames, 2)
+        if total_frames else 0,
+        'wall_ms_per_frame': round(wall_time * 1000 / total_frames, 2) if total_frames else 0
+    }
+    return results, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.render',
+                                     description='Headless batch render of plasma videos')
+    parser.add_argument('images_dir', help='directory with source images')
+    parser.add_argument('spec', help='JSON or JSONL file with crops and saturation per image')
+    parser.add_argument('--output', default='render_output', help='output directory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--profile', default='balanced', choices=sorted(Config.VIDEO_PROFILES),
+                        help='encoding profile')
+    parser.add_argument('--threads', type=int, default=1, help='ffmpeg threads per worker')
+    parser.add_argument('--targets', nargs='+', default=[], choices=sorted(Config.OUTPUT_TARGETS),
+                        help='extra output formats rendered in the same pass')
+    parser.add_argument('--summary-json', help='write the summary to this file')
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = load_spec(args.spec, args.targets)
+    except ValueError as e:
+        parser.error(str(e))
+    if not jobs:
+        parser.error('spec contains no jobs')
+
+    workers = max(1, min(args.workers, len(jobs)))
+    results, summary = render_all(jobs, args.images_dir, args.output, workers, args.profile, args.threads,
+                                  args.targets)
+
+    print(f"\nRendered {summary['succeeded']}/{summary['jobs']} videos in {summary['wall_time']:.2f}s "
+          f"with {summary['workers']} workers: {summary['videos_per_min']:.2f} videos/min, "
+          f"{summary['ms_per_frame']:.1f} ms/frame per worker, "
+          f"{summary['wall_ms_per_frame']:.1f} ms/frame overall")
+
+    if args.summary_json:
+        with open(args.summary_json, 'w') as f:
+            json.dump({'summary': summary, 'results': sorted(results, key=lambda r: r['index'])}, f, indent=2)
+
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# startup_benchmark.py
+"""Замер холодного старта.
+
+Использование:
+    python -m app.startup_benchmark [--runs N] [--port PORT] [--api-port PORT]
+
+Каждый замер выполняется в отдельном процессе:
+- first_reply: от запуска процесса бота до ответа на /start, полученного поддельным
+  Bot API из app.loadtest (/start отправлен до запуска, как от пользователя, ждущего холодного бота)
+- bot_import: от запуска процесса до готовности модуля бота (вспомогательная метрика)
+- http_up: от запуска Flask-процесса до первого ответа /health
+- ready: от запуска Flask-процесса до статуса ready на /health (прогрев завершен)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+from .config import Config
+from .loadtest import FakeBotApi, FakeBotApiHandler, start_bot
+
+PROJECT_ROOT = os.path.dirname(Config.BASE_DIR)
+
+BOT_IMPORT_SCRIPT = "import app.plazmoid_bot; print('imported', flush=True)"
+FLASK_SCRIPT = (
+    "from app.app import VideoGeneratorApp; "
+    "VideoGeneratorApp().app.run(host='127.0.0.1', port={port}, use_reloader=False)"
+)
+
+
+def _spawn(script, cwd):
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT)
+    return subprocess.Popen([sys.executable, '-c', script], cwd=cwd, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+
+def measure_bot_import(workdir):
+    start = time.perf_counter()
+    process = _spawn(BOT_IMPORT_SCRIPT, workdir)
+    process.stdout.readline()
+    elapsed = time.perf_counter() - start
+    process.wait()
+    return elapsed
+
+
+def measure_first_reply(workdir, api, api_port, chat_id, timeout):
+    user = {'id': chat_id, 'is_bot': False, 'first_name': f"User{chat_id}"}
+    api.add_update({'message': {
+        'message_id': 1,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': user,
+        'text': '/start',
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len('/start')}]
+    }})
+
+    # Время событий FakeBotApi - time.time()
+    start = time.time()
+    process = start_bot(api_port, workdir)
+    try:
+        event = api.wait_for(chat_id, lambda method, params: method == 'sendMessage', timeout)
+        if event is None:
+            raise TimeoutError(f"Bot did not reply to /start within {timeout}s")
+        return event[0] - start
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def measure_flask_startup(workdir, port, timeout):
+    url = f"http://127.0.0.1:{port}/health"
+    start = time.perf_counter()
+    process = _spawn(FLASK_SCRIPT.format(port=port), workdir)
+    http_up = None
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    status = json.load(response)['status']
+            except urllib.error.HTTPError as e:
+                status = json.load(e)['status']
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.02)
+                continue
+
+            if http_up is None:
+                http_up = time.perf_counter() - start
+            if status == 'ready':
+                return http_up, time.perf_counter() - start
+            if status == 'error':
+                raise RuntimeError("Warm-up failed, see /health")
+            time.sleep(0.05)
+        raise TimeoutError(f"Flask app was not ready within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def _describe(values):
+    return {
+        'min': round(min(values), 3),
+        'median': round(statistics.median(values), 3),
+        'max': round(max(values), 3)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.startup_benchmark',
+                                     description='Measure cold-start time of the bot and the web app')
+    parser.add_argument('--runs', type=int, default=3, help='number of cold starts to measure')
+    parser.add_argument('--port', type=int, default=5055, help='port for the Flask app under test')
+    parser.add_argument('--api-port', type=int, default=8081, help='port for the fake Bot API server')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for readiness')
+    args = parser.parse_args(argv)
+
+    api = FakeBotApi()
+    FakeBotApiHandler.api = api
+    server = ThreadingHTTPServer(('127.0.0.1', args.api_port), FakeBotApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {'first_reply': [], 'bot_import': [], 'http_up': [], 'ready': []}
+    # Бот пишет bot.log в текущую директорию, поэтому замеры идут во временной
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for run in range(args.runs):
+                results['first_reply'].append(
+                    measure_first_reply(workdir, api, args.api_port, 20000 + run, args.timeout))
+                results['bot_import'].append(measure_bot_import(workdir))
+                http_up, ready = measure_flask_startup(workdir, args.port, args.timeout)
+                results['http_up'].append(http_up)
+                results['ready'].append(ready)
+                print(f"run {run + 1}: first_reply {results['first_reply'][-1]:.3f}s, "
+                      f"bot_import {results['bot_import'][-1]:.3f}s, "
+                      f"http_up {http_up:.3f}s, ready {ready:.3f}s", flush=True)
+    finally:
+        server.shutdown()
+
+    print(json.dumps({name: _describe(values) for name, values in results.items()}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())